@@ -24,7 +24,7 @@ setup(
     author_email="tamas.schneider@gmail.com",
     install_requires=REQUIRED,
     tests_require=TESTS_REQUIRE,
-    python_requires='>=3.6',
+    python_requires='>=3.8',
     keywords=["webscraping", "rightmove", "data"],
     license="MIT",
     classifiers=[
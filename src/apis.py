@@ -1,26 +1,80 @@
+import asyncio
 import logging
+from typing import List, Optional
 import requests
 import urllib.parse
-import json
+import numpy as np
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 # from xml.etree import ElementTree
-from src.helpers import deg_to_dms
+from src.helpers import deg_to_dms, deg_to_dms_array
 from src.caches import FileCache
-from src.helpers import nested_key_exists
+from src.helpers import is_event_loop_running, json_loads
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
 
 logger = logging.getLogger(__name__)
 
+if msgspec is not None:
+    # only the fields of the directions API response which are used, the rest is skipped while decoding
+    class _DirectionsText(msgspec.Struct):
+        text: Optional[str] = None
+
+    class _DirectionsLeg(msgspec.Struct):
+        distance: _DirectionsText = msgspec.field(default_factory=_DirectionsText)
+        duration: _DirectionsText = msgspec.field(default_factory=_DirectionsText)
+
+    class _DirectionsRoute(msgspec.Struct):
+        legs: List[_DirectionsLeg] = []
+
+    class _DirectionsResponse(msgspec.Struct):
+        status: str = "Unknown"
+        error_message: str = "Unknown Error"
+        routes: List[_DirectionsRoute] = []
+
+    _directions_response_decoder = msgspec.json.Decoder(_DirectionsResponse)
+
 
 class GoogleMapsApi:
     API_BASE_URL = "https://maps.googleapis.com/maps/api"
 
+    # (connect, read) timeout in seconds for the API requests
+    REQUEST_TIMEOUT = (3.05, 10)
+
+    # limits of a single distance matrix API call
+    MATRIX_MAX_ORIGINS = 25
+    MATRIX_MAX_DESTINATIONS = 25
+    MATRIX_MAX_ELEMENTS = 100
+
     # @TODO - add support for xml
-    def __init__(self, api_key: str, file_cache: FileCache = None, response_type="json"):
+    def __init__(
+        self,
+        api_key: str,
+        file_cache: FileCache = None,
+        response_type="json",
+        max_cache_age=None,
+        session: requests.Session = None
+    ):
         """
         This class handles api calls made to the Google Maps API services.
         Args:
             api_key (str): API key to Google Maps API - https://developers.google.com/maps
             file_cache (FileCache|None): FileCache object for caching the responses from the API in a file
             response_type (str): Output format received from the API response
+            max_cache_age (int|None): Seconds after which cached responses are revalidated with the API
+                (using their ETag if the API sent one), cached responses never expire if None
+            session (requests.Session|None): Session used for the synchronous API calls, e.g. shared with other
+                clients. A pooled session is created (and closed by `close`) if None. The concurrent calls of
+                `get_all_directions` are made with a separate aiohttp session when aiohttp is installed, which
+                doesn't use the adapters, proxies, cookies or auth of this session.
         """
         if not self._is_valid_response_type(response_type):
             raise ValueError(f"Invalid response type:\n\n\t{response_type}")
@@ -28,6 +82,49 @@ class GoogleMapsApi:
         self._api_key = api_key
         self._file_cache = file_cache
         self._response_type = response_type
+        self._max_cache_age = max_cache_age
+
+        # static parts of the directions urls
+        self._directions_url_prefix = f"{self.API_BASE_URL}/directions/{self.response_type}?origin="
+        self._url_key_suffix = f"&key={urllib.parse.quote_plus(str(api_key))}"
+
+        # keep the connection to the API alive between the calls
+        self._owns_session = session is None
+        if session is None:
+            session = requests.Session()
+            session.mount("https://", HTTPAdapter(
+                pool_connections=4,
+                pool_maxsize=32,
+                # the last response is returned when the retries run out, so its status code can be checked
+                max_retries=Retry(
+                    total=3,
+                    backoff_factor=0.2,
+                    status_forcelist=[429, 500, 502, 503, 504],
+                    raise_on_status=False
+                )
+            ))
+        self._session = session
+
+        # event loop and session for the concurrent API calls, both created on first use
+        self._loop = None
+        self._aiohttp_session = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """Closes the underlying HTTP sessions, a session passed in during init is left open."""
+        if self._owns_session:
+            self._session.close()
+        if self._loop is not None:
+            if self._aiohttp_session is not None:
+                self._loop.run_until_complete(self._aiohttp_session.close())
+                self._aiohttp_session = None
+            self._loop.close()
+            self._loop = None
 
     @property
     def api_key(self):
@@ -47,17 +144,139 @@ class GoogleMapsApi:
         lon_dms = deg_to_dms(longitude, 'lon')
         return f"https://www.google.com/maps/place/{lat_dms}+{lon_dms}"
 
+    @staticmethod
+    def get_google_maps_urls(latitudes, longitudes):
+        """Same as `get_google_maps_url` for arrays of coordinates, the url is NaN when a coordinate is missing."""
+        return [
+            f"https://www.google.com/maps/place/{lat_dms}+{lon_dms}" if lat_dms and lon_dms else np.nan
+            for (lat_dms, lon_dms) in zip(deg_to_dms_array(latitudes, 'lat'), deg_to_dms_array(longitudes, 'lon'))
+        ]
+
     def get_directions(self, origin: str, place_id: str, mode=None, arrival_time=None):
-        # default return
-        direction = {
-            'distance': None,
-            'duration': None,
-        }
+        # build urls for the request and cache
+        url = self._build_directions_url(origin, place_id, mode, arrival_time)
+
+        # try to return the cached direction if there's any
+        content = self._get_cache(url)
+        if content:
+            return content
+
+        # cache not found or expired, make the API call
+        logger.info("Calling url: %s", url)
+        try:
+            response = self._session.get(
+                url, headers=self._get_cache_validation_headers(url), timeout=self.REQUEST_TIMEOUT
+            )
+        except requests.RequestException as error:
+            logger.error("Request failed: %r", error)
+            return self._empty_direction()
+
+        # expired cache is still valid
+        if response.status_code == 304:
+            return self._get_revalidated_cache(url)
+
+        # validate response
+        if response.status_code != 200:
+            logger.error("Status code is NOT OK: %s", response.status_code)
+            return self._empty_direction()
+
+        return self._read_directions_content(url, response.content, response.headers.get('ETag'))
+
+    async def get_directions_async(self, session, origin: str, place_id: str, mode=None, arrival_time=None):
+        """Same as `get_directions`, but the API call is made with the given aiohttp session.
+        Args:
+            session (aiohttp.ClientSession): Session used for making the API call
+            origin (str): Origin of the directions, e.g. "latitude,longitude"
+            place_id (str): Place id of the destination
+            mode (str|None): Travel mode to the destination
+            arrival_time (int|None): Time of arrival at the destination
+        """
+        # build urls for the request and cache
+        url = self._build_directions_url(origin, place_id, mode, arrival_time)
+
+        # try to return the cached direction if there's any
+        content = self._get_cache(url)
+        if content:
+            return content
+
+        # cache not found or expired, make the API call
+        logger.info("Calling url: %s", url)
+        try:
+            async with session.get(url, headers=self._get_cache_validation_headers(url)) as response:
+                # expired cache is still valid
+                if response.status == 304:
+                    return self._get_revalidated_cache(url)
+
+                # validate response
+                if response.status != 200:
+                    logger.error("Status code is NOT OK: %s", response.status)
+                    return self._empty_direction()
+
+                content = await response.read()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+            logger.error("Request failed: %r", error)
+            return self._empty_direction()
+
+        return self._read_directions_content(url, content, response.headers.get('ETag'))
+
+    def get_all_directions(self, origin: str, directions_config):
+        """Gets the directions from the origin to every destination of the directions config.
+        The API calls are made concurrently if aiohttp is installed, otherwise one after the other. They are also
+        made one after the other when called from a running event loop, since the loop of the object can't run then.
+        Args:
+            origin (str): Origin of the directions, e.g. "latitude,longitude"
+            directions_config (list|tuple): Directions params with place_id, mode and optional arrival_time keys
+        :return: List of directions in the order of the directions config
+        """
+        if aiohttp is None or is_event_loop_running():
+            return [
+                self.get_directions(
+                    origin=origin,
+                    place_id=direction_config['place_id'],
+                    mode=direction_config['mode'],
+                    arrival_time=direction_config.get('arrival_time')
+                )
+                for direction_config in directions_config
+            ]
+
+        return self._get_event_loop().run_until_complete(self._gather_directions(origin, directions_config))
+
+    def get_distance_matrix(self, origins, place_ids, mode=None, arrival_time=None):
+        """Gets the directions from every origin to every destination, using as few distance matrix API calls as
+        the limits of the API allow. Every direction is cached under the same url as a `get_directions` call
+        would be, so the cached directions are shared between the two.
+        Args:
+            origins (list): Origins of the directions, e.g. "latitude,longitude"
+            place_ids (list): Place ids of the destinations
+            mode (str|None): Travel mode to the destinations
+            arrival_time (int|None): Time of arrival at the destinations
+        :return: Dictionary of directions keyed by (origin, place_id), directions which couldn't be found are left out
+        """
+        directions = {}
+
+        # try to use the cached directions if there's any
+        uncached_origins = []
+        for origin in dict.fromkeys(origins):
+            for place_id in place_ids:
+                content = self._get_cache(self._build_directions_url(origin, place_id, mode, arrival_time))
+                if content:
+                    directions[(origin, place_id)] = content
+            if any((origin, place_id) not in directions for place_id in place_ids):
+                uncached_origins.append(origin)
+
+        # cache not found, make the API calls in chunks fitting into the limits
+        for place_ids_chunk in self._chunk(place_ids, self.MATRIX_MAX_DESTINATIONS):
+            origins_chunk_size = min(self.MATRIX_MAX_ORIGINS, self.MATRIX_MAX_ELEMENTS // len(place_ids_chunk))
+            for origins_chunk in self._chunk(uncached_origins, origins_chunk_size):
+                directions.update(self._call_distance_matrix(origins_chunk, place_ids_chunk, mode, arrival_time))
+
+        return directions
 
+    def _call_distance_matrix(self, origins, place_ids, mode=None, arrival_time=None):
         # mandatory params
         params = {
-            'origin': origin,
-            'destination': f"place_id:{place_id}",
+            'origins': '|'.join(origins),
+            'destinations': '|'.join(f"place_id:{place_id}" for place_id in place_ids),
         }
         # optional params
         if mode is not None:
@@ -65,59 +284,163 @@ class GoogleMapsApi:
         if arrival_time is not None:
             params['arrival_time'] = arrival_time
 
-        # build urls for the request and cache
-        url = self._build_api_call_url(params=params, service="directions")
-
-        # try to return the cached direction if there's any
-        content = self._get_cache(url)
-        if content:
-            return content
-
-        # cache not found, make the API call
-        logger.info(f"Calling url: {url}")
-        response = requests.get(url)
+        url = self._build_api_call_url(params=params, service="distancematrix")
+        logger.info("Calling url: %s", url)
+        try:
+            response = self._session.get(url, timeout=self.REQUEST_TIMEOUT)
+        except requests.RequestException as error:
+            logger.error("Request failed: %r", error)
+            return {}
 
         # validate response
         if response.status_code != 200:
-            logger.error(f"Status code is NOT OK: {response.status_code}")
-            return direction
+            logger.error("Status code is NOT OK: %s", response.status_code)
+            return {}
 
-        content = response.json()
+        content = json_loads(response.content)
         if content.get("status") != "OK":
-            logger.error(f"API status: {content.get('status', 'Unknown')}")
-            logger.error(f"API error: {content.get('error_message', 'Unknown Error')}")
-            return direction
+            logger.error("API status: %s", content.get('status', 'Unknown'))
+            logger.error("API error: %s", content.get('error_message', 'Unknown Error'))
+            return {}
 
-        # get the response content
-        try:
-            # read data from this format >>> direction['routes'][0]['legs'][0]['distance']['text']
-            routes = content.get('routes', [])
-            legs = routes[0].get('legs', {})
-            leg = legs[0]
-        except KeyError:
-            leg = {}
+        # read data from this format >>> matrix['rows'][origin]['elements'][destination]['distance']['text']
+        directions = {}
+        for (origin, row) in zip(origins, content.get('rows', [])):
+            for (place_id, element) in zip(place_ids, row.get('elements', [])):
+                if element.get('status') != "OK":
+                    logger.error(
+                        "Direction status from %s to %s: %s", origin, place_id, element.get('status', 'Unknown')
+                    )
+                    continue
+
+                duration = element.get('duration', {}).get('text')
+                distance = element.get('distance', {}).get('text')
+                if not duration or not distance:
+                    logger.error("Duration or distance of trip not found from %s to %s", origin, place_id)
+                    continue
+
+                direction = {
+                    'distance': distance,
+                    'duration': duration
+                }
+                self._save_cache(self._build_directions_url(origin, place_id, mode, arrival_time), direction)
+                directions[(origin, place_id)] = direction
+
+        return directions
+
+    @staticmethod
+    def _chunk(items, size):
+        return [items[i:i + size] for i in range(0, len(items), size)]
+
+    async def _gather_directions(self, origin, directions_config):
+        session = self._get_aiohttp_session()
+        return await asyncio.gather(*[
+            self.get_directions_async(
+                session,
+                origin=origin,
+                place_id=direction_config['place_id'],
+                mode=direction_config['mode'],
+                arrival_time=direction_config.get('arrival_time')
+            )
+            for direction_config in directions_config
+        ])
+
+    def _get_event_loop(self):
+        # a single loop is kept for the whole lifetime of the object, so the aiohttp session can be reused
+        if self._loop is None:
+            self._loop = asyncio.new_event_loop()
+        return self._loop
+
+    def _get_aiohttp_session(self):
+        # has to be created from inside the running event loop
+        if self._aiohttp_session is None:
+            self._aiohttp_session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=20, ttl_dns_cache=300),
+                timeout=aiohttp.ClientTimeout(sock_connect=self.REQUEST_TIMEOUT[0], sock_read=self.REQUEST_TIMEOUT[1])
+            )
+        return self._aiohttp_session
+
+    @staticmethod
+    def _empty_direction():
+        return {
+            'distance': None,
+            'duration': None,
+        }
+
+    def _build_directions_url(self, origin, place_id, mode=None, arrival_time=None):
+        # params are in the same order and quoted the same way as with `_build_api_call_url`,
+        # so the urls already used as cache keys stay the same
+        quote = urllib.parse.quote_plus
+        # mandatory params
+        url = f"{self._directions_url_prefix}{quote(str(origin))}&destination={quote(f'place_id:{place_id}')}"
+        # optional params
+        if mode is not None:
+            url += f"&mode={quote(str(mode))}"
+        if arrival_time is not None:
+            url += f"&arrival_time={quote(str(arrival_time))}"
+
+        return url + self._url_key_suffix
+
+    def _read_directions_content(self, url, content, etag=None):
+        """Reads the distance and duration from the body of a directions API response and caches them.
+        :return: Dictionary of the distance and duration, both set to None if the response is invalid
+        """
+        direction = self._empty_direction()
+
+        status, error_message, duration, distance = self._decode_directions_content(content)
+        if status != "OK":
+            logger.error("API status: %s", status)
+            logger.error("API error: %s", error_message)
+            return direction
 
-        if not nested_key_exists(leg, ["duration", "text"]):
+        if not duration:
             logger.error("Duration of trip not found in response")
             return direction
-        if not nested_key_exists(leg, ["distance", "text"]):
+        if not distance:
             logger.error("Distance of trip not found in response")
             return direction
 
-        duration = leg.get('duration', {}).get('text')
-        distance = leg.get('distance', {}).get('text')
-
         direction = {
             'distance': distance,
             'duration': duration
         }
-        cached_content = json.dumps(direction, separators=(',', ':'))
 
         # try to cache file
-        self._save_cache(url, cached_content)
+        self._save_cache(url, direction, etag)
 
         return direction
 
+    @staticmethod
+    def _decode_directions_content(content):
+        """Decodes the body of a directions API response, only reading the fields that are used.
+        :return: Tuple of the status, error message, and duration and distance (None if not found) of the trip
+        """
+        if msgspec is not None:
+            try:
+                response = _directions_response_decoder.decode(content)
+            except msgspec.DecodeError as error:
+                return "Unknown", str(error), None, None
+
+            # read data from this format >>> direction.routes[0].legs[0].distance.text
+            if not response.routes or not response.routes[0].legs:
+                return response.status, response.error_message, None, None
+            leg = response.routes[0].legs[0]
+            return response.status, response.error_message, leg.duration.text, leg.distance.text
+
+        content = json_loads(content)
+        status = content.get('status', 'Unknown')
+        error_message = content.get('error_message', 'Unknown Error')
+
+        # read data from this format >>> direction['routes'][0]['legs'][0]['distance']['text']
+        try:
+            routes = content.get('routes', [])
+            legs = routes[0].get('legs', [])
+            leg = legs[0]
+        except (KeyError, IndexError):
+            leg = {}
+
+        return status, error_message, leg.get('duration', {}).get('text'), leg.get('distance', {}).get('text')
+
     def _build_api_call_url(self, params: dict, service: str):
         all_params = dict(params)
         all_params['key'] = self.api_key
@@ -129,18 +452,29 @@ class GoogleMapsApi:
         if not self._file_cache:
             return None
 
-        # if no file is saved for the url ignore
-        content = self._file_cache.get_cached_file_content(url)
-        if not content:
-            return None
-
-        # return parsed cached data based on return type
+        # return parsed cached data based on return type, if no (fresh enough) file is saved for the url ignore
         if self.response_type == 'json':
-            return json.loads(content)
+            return self._file_cache.get_cached_file_content(url, max_age=self._max_cache_age, loads=json_loads)
         # elif self.response_type == 'xml':
-        #     return content
+        #     return self._file_cache.get_cached_file_content(url, max_age=self._max_cache_age)
+
+    def _get_cache_validation_headers(self, url):
+        # if file cache is not set up or the cached response has no etag ignore
+        if not self._file_cache:
+            return None
+
+        etag = self._file_cache.get_cached_file_etag(url)
+        if not etag:
+            return None
+
+        return {'If-None-Match': etag}
+
+    def _get_revalidated_cache(self, url):
+        logger.info("Cached response is still valid: %s", url)
+        self._file_cache.refresh_cache_file(url)
+        return self._get_cache(url) or self._empty_direction()
 
-    def _save_cache(self, url, response):
+    def _save_cache(self, url, response, etag=None):
         # if file cache is not set up or response is empty ignore
         if not self._file_cache or not response:
             return None
@@ -149,5 +483,6 @@ class GoogleMapsApi:
         self._file_cache.create_cache_file(
             hash_key=url,
             content=response,
-            extension=self.response_type
+            extension=self.response_type,
+            etag=etag
         )
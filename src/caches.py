@@ -1,94 +1,358 @@
-import json
-import uuid
+import hashlib
+import mmap
+import os
+import struct
+import time
 import logging
 from pathlib import Path
+from src.helpers import json_dumps, json_loads
 
 logger = logging.getLogger(__name__)
 
 
 class FileCache:
+    # header of the index file: magic bytes, number of slots, number of used slots
+    INDEX_HEADER = struct.Struct("<8sQQ")
+    INDEX_MAGIC = b"FCINDEX1"
+
+    # slot of the index file: hash of the key used for probing, digest of the key, offset of the record in the heap
+    INDEX_SLOT = struct.Struct("<Q64sQ")
+
+    # initial number of slots in the index, has to be a power of 2
+    INDEX_INITIAL_CAPACITY = 1024
+
+    # ratio of used slots after which the index is doubled in size
+    INDEX_MAX_LOAD_FACTOR = 0.7
+
+    # the heap starts with magic bytes, so an offset of 0 can mark an empty slot in the index
+    HEAP_MAGIC = b"FCHEAP1\n"
+
+    # length prefix of every record in the heap
+    HEAP_RECORD_HEADER = struct.Struct("<I")
+
+    # separates the file path and the optional etag in a heap record
+    HEAP_RECORD_SEPARATOR = b"\0"
+
+    # cache files smaller than this are read directly, larger ones are memory-mapped when parsed
+    MMAP_MIN_FILE_SIZE = 4096
+
     def __init__(self, base_path: str):
         """
         FileCache class handles caching files using a hashmap, can be used to store e.g. json responses from API calls.
         Initialize the class with the path of the cache folder.
-        Class will create the folders recursively if they don't exist, and will add a hashmap file.
+        Class will create the folders recursively if they don't exist, and will add the hashmap files.
+        The hashmap is an open addressing hash table in a memory-mapped index file, its slots point to the
+        file paths appended to a heap file. Hashmaps of the earlier JSON format are migrated on setup.
         Args:
             base_path (str): Path of the base cache folder where files should be saved.
         """
         self._base_path = Path(base_path)
-        self._hashmap_file_path = Path(f"{self._base_path}/_hashmap.json")
+        # used for building the cache file paths without going through Path every time
+        self._base_path_str = str(self._base_path)
+        self._index_file_path = self._base_path / "_index.mmap"
+        self._heap_file_path = self._base_path / "_heap.bin"
+
+        # file used by the earlier JSON hashmap format
+        self._legacy_hashmap_file_path = self._base_path / "_hashmap.json"
+
+        # the mapped files are kept open for the lifetime of the object, and only mapped again
+        # when another FileCache instance changed them
+        self._index = None
+        self._index_inode = None
+        self._index_capacity = 0
+        self._heap_file = None
+        self._heap = None
 
         self._setup()
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """Closes the mapped index and heap, and the heap file."""
+        for f in (self._index, self._heap, self._heap_file):
+            if f is not None:
+                f.close()
+        self._index = self._heap = self._heap_file = None
+
+    @property
+    def index_file_path(self):
+        return self._index_file_path
+
     @property
-    def hashmap_file_path(self):
-        return self._hashmap_file_path
+    def heap_file_path(self):
+        return self._heap_file_path
 
     @property
     def base_path(self):
         return self._base_path
 
-    @property
-    def hashmap(self):
-        with self.hashmap_file_path.open("r") as f:
-            return json.load(f)
-
-    def create_cache_file(self, hash_key: str, content: str, extension: str, uuid_namespace=uuid.NAMESPACE_URL):
-        new_file_path = self._add_file_to_hashmap(hash_key, extension, uuid_namespace)
-        with new_file_path.open('w') as f:
-            f.write(content)
+    def create_cache_file(self, hash_key: str, content, extension: str, etag: str = None):
+        """Saves content in a cache file for the key.
+        Args:
+            hash_key (str): Key of the cached content, e.g. the url of an API call
+            content (bytes|str|dict): Content of the file, dictionaries are serialized to JSON
+            extension (str): Extension of the cache file
+            etag (str|None): ETag of the response the content is from, used for revalidating the content later
+        """
+        if isinstance(content, dict):
+            content = json_dumps(content)
+        elif isinstance(content, str):
+            content = content.encode('utf-8')
+
+        new_file_path = self._add_file_to_hashmap(hash_key, extension, etag)
+        new_file_path.write_bytes(content)
         return True
 
-    def get_cached_file_content(self, hash_key):
+    def get_cached_file_content(self, hash_key, max_age=None, loads=None):
+        """Gets the content of the cache file of the key.
+        Args:
+            hash_key (str): Key of the cached content
+            max_age (int|float|None): Seconds since the file was created or refreshed after which it's ignored
+            loads (callable|None): Function parsing the content, e.g. json_loads. Files of at least
+                MMAP_MIN_FILE_SIZE bytes are passed to it as a memoryview of the mapped file instead of bytes.
+        :return: Bytes (or parsed data) of the content or None if there's no (fresh enough) cache file for the key
+        """
         file_path = self._get_file_path_from_hashmap(hash_key)
-        if not file_path or not file_path.exists():
-            logger.debug(f"No cached content found for {hash_key}")
+        try:
+            file_stat = file_path.stat() if file_path else None
+        except FileNotFoundError:
+            file_stat = None
+        if not file_stat:
+            # called for every lookup, skip the call when debug logs are not emitted
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("No cached content found for %s", hash_key)
             return None
 
-        logger.debug(f"Cached content found for {hash_key}")
-        with file_path.open('r') as f:
-            return f.read()
+        if max_age is not None and time.time() - file_stat.st_mtime > max_age:
+            logger.debug("Cached content expired for %s", hash_key)
+            return None
+
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Cached content found for %s", hash_key)
+        if loads is None:
+            return file_path.read_bytes()
+        if file_stat.st_size < self.MMAP_MIN_FILE_SIZE:
+            return loads(file_path.read_bytes())
+
+        # parse the content straight from the mapped file, without reading it into memory first
+        with file_path.open('rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            with memoryview(mm) as content:
+                return loads(content)
+
+    def get_cached_file_etag(self, hash_key):
+        """Gets the ETag saved with the cache file of the key, None if the file has no ETag or doesn't exist
+        anymore, since the content couldn't be reused after it's revalidated."""
+        entry = self._get_hashmap_entry(hash_key)
+        if not entry or not entry[1] or not entry[0].exists():
+            return None
+        return entry[1]
+
+    def refresh_cache_file(self, hash_key):
+        """Marks the cache file of the key as fresh again, e.g. after its content was revalidated."""
+        file_path = self._get_file_path_from_hashmap(hash_key)
+        if not file_path or not file_path.exists():
+            return False
+
+        os.utime(file_path)
+        logger.debug("Refreshed cached content for %s", hash_key)
+        return True
 
     # adds a new entry to the hash table and returns a Path for the file
-    def _add_file_to_hashmap(self, hash_key, extension, uuid_namespace):
-        hashmap_data = self.hashmap
-        with self.hashmap_file_path.open("w+") as f:
-            uuid_filename_str = str(uuid.uuid5(uuid_namespace, hash_key))
-            hashmap_data[hash_key] = self._generate_file_pathname_for_uuid(uuid_filename_str, extension)
-            logger.debug(f"Added key to hashmap: {hash_key}")
-            f.write(json.dumps(hashmap_data))
-        return Path(hashmap_data[hash_key])
+    def _add_file_to_hashmap(self, hash_key, extension, etag=None):
+        key_hash, key_digest = self._hash_key(hash_key)
+        # the filename is derived from the digest of the key, paths of earlier entries are kept as they are
+        file_pathname = self._generate_file_pathname(key_digest[:16].hex(), extension)
+        self._add_index_entry(key_hash, key_digest, file_pathname, etag)
+        logger.debug("Added key to hashmap: %s", hash_key)
+        return Path(file_pathname)
 
     # gets a cached file as a Path from the hashmap
     def _get_file_path_from_hashmap(self, hash_key):
-        with self.hashmap_file_path.open("r") as f:
-            hashmap = json.load(f)
-            filename = hashmap.get(hash_key)
-        return Path(filename) if filename else None
+        entry = self._get_hashmap_entry(hash_key)
+        return entry[0] if entry else None
+
+    def _get_hashmap_entry(self, hash_key):
+        """Gets the entry of a key from the hashmap.
+        :return: Tuple of the Path of the cached file and its ETag (or None), None if the key is not found
+        """
+        key_hash, key_digest = self._hash_key(hash_key)
+        _, heap_offset = self._find_index_slot(key_hash, key_digest)
+        if not heap_offset and self._is_index_replaced():
+            # another instance resized the index, probe the new one
+            self._index.close()
+            self._open_index()
+            _, heap_offset = self._find_index_slot(key_hash, key_digest)
+        if not heap_offset:
+            return None
+
+        # records of entries without an etag only hold the file path
+        file_pathname, _, etag = self._read_heap_record(heap_offset).partition(self.HEAP_RECORD_SEPARATOR)
+        return Path(file_pathname.decode("utf-8")), etag.decode("utf-8") or None
+
+    @staticmethod
+    def _hash_key(hash_key):
+        """Hashes a key for the index.
+        :return: Tuple of the 64 bit hash used for probing and the full digest used for comparing keys
+        """
+        key_digest = hashlib.blake2b(hash_key.encode("utf-8"), digest_size=64).digest()
+        return int.from_bytes(key_digest[:8], "little"), key_digest
+
+    def _get_index_slot_position(self, slot):
+        return self.INDEX_HEADER.size + slot * self.INDEX_SLOT.size
+
+    def _find_index_slot(self, key_hash, key_digest):
+        """Probes the index linearly for a key.
+        :return: Tuple of the slot of the key and its heap offset, or the first empty slot and 0 if key is not found
+        """
+        mask = self._index_capacity - 1
+        slot = key_hash & mask
+        while True:
+            slot_key_hash, slot_key_digest, heap_offset = self.INDEX_SLOT.unpack_from(
+                self._index, self._get_index_slot_position(slot)
+            )
+            if not heap_offset or (slot_key_hash == key_hash and slot_key_digest == key_digest):
+                return slot, heap_offset
+            slot = (slot + 1) & mask
+
+    def _add_index_entry(self, key_hash, key_digest, file_pathname, etag=None):
+        record = file_pathname.encode("utf-8")
+        if etag:
+            record += self.HEAP_RECORD_SEPARATOR + etag.encode("utf-8")
+        heap_offset = self._append_heap_record(record)
+
+        if self._is_index_replaced():
+            # another instance resized the index, write to the new one
+            self._index.close()
+            self._open_index()
+        slot, old_heap_offset = self._find_index_slot(key_hash, key_digest)
+        self.INDEX_SLOT.pack_into(self._index, self._get_index_slot_position(slot), key_hash, key_digest, heap_offset)
+        if old_heap_offset:
+            return
+
+        # the count is read from the index, since other instances might have added entries as well
+        index_count = self._get_index_count() + 1
+        self.INDEX_HEADER.pack_into(self._index, 0, self.INDEX_MAGIC, self._index_capacity, index_count)
+        if index_count > self._index_capacity * self.INDEX_MAX_LOAD_FACTOR:
+            self._resize_index(self._index_capacity * 2)
+
+    def _append_heap_record(self, data: bytes):
+        """Appends a length prefixed record to the heap.
+        :return: Offset of the record in the heap
+        """
+        # the real end of the file, other instances might have appended records as well
+        heap_offset = self._heap_file.seek(0, os.SEEK_END)
+        self._heap_file.write(self.HEAP_RECORD_HEADER.pack(len(data)) + data)
+        self._heap_file.flush()
+        return heap_offset
+
+    def _read_heap_record(self, heap_offset):
+        # map the heap again if the record was appended since it was last mapped
+        if len(self._heap) < heap_offset + self.HEAP_RECORD_HEADER.size:
+            self._heap.close()
+            self._heap = self._map_file(self.heap_file_path, access=mmap.ACCESS_READ)
+
+        (length,) = self.HEAP_RECORD_HEADER.unpack_from(self._heap, heap_offset)
+        start = heap_offset + self.HEAP_RECORD_HEADER.size
+        return self._heap[start:start + length]
+
+    @staticmethod
+    def _map_file(file_path, access=mmap.ACCESS_WRITE):
+        # the mapping stays valid after the file is closed
+        with file_path.open("rb" if access == mmap.ACCESS_READ else "r+b") as f:
+            return mmap.mmap(f.fileno(), 0, access=access)
+
+    def _create_index_file(self, file_path, capacity):
+        with file_path.open("wb") as f:
+            f.write(self.INDEX_HEADER.pack(self.INDEX_MAGIC, capacity, 0))
+            f.truncate(self._get_index_slot_position(capacity))
+
+    def _open_index(self):
+        with self.index_file_path.open("r+b") as f:
+            self._index = mmap.mmap(f.fileno(), 0)
+            self._index_inode = os.fstat(f.fileno()).st_ino
+
+        magic, self._index_capacity, _ = self.INDEX_HEADER.unpack_from(self._index, 0)
+        if magic != self.INDEX_MAGIC:
+            raise ValueError(f"Invalid cache index file:\n\n\t{self.index_file_path}")
+
+    def _get_index_count(self):
+        _, _, index_count = self.INDEX_HEADER.unpack_from(self._index, 0)
+        return index_count
+
+    def _is_index_replaced(self):
+        return self.index_file_path.stat().st_ino != self._index_inode
+
+    def _resize_index(self, capacity):
+        """Rebuilds the index with the given number of slots, heap records are left untouched."""
+        logger.info("Resizing hashmap index to %s slots", capacity)
+        tmp_file_path = self.index_file_path.with_suffix(".tmp")
+        self._create_index_file(tmp_file_path, capacity)
+
+        index_count = self._get_index_count()
+        old_index, old_capacity = self._index, self._index_capacity
+        self._index, self._index_capacity = self._map_file(tmp_file_path), capacity
+        for old_slot in range(old_capacity):
+            key_hash, key_digest, heap_offset = self.INDEX_SLOT.unpack_from(
+                old_index, self._get_index_slot_position(old_slot)
+            )
+            if heap_offset:
+                slot, _ = self._find_index_slot(key_hash, key_digest)
+                self.INDEX_SLOT.pack_into(
+                    self._index, self._get_index_slot_position(slot), key_hash, key_digest, heap_offset
+                )
+        self.INDEX_HEADER.pack_into(self._index, 0, self.INDEX_MAGIC, self._index_capacity, index_count)
+
+        old_index.close()
+        self._index.close()
+        tmp_file_path.replace(self.index_file_path)
+        self._open_index()
+
+    def _migrate_legacy_hashmap(self):
+        """Moves the entries of the JSON hashmap file used by the earlier versions into the index."""
+        if not self._legacy_hashmap_file_path.exists():
+            return
+
+        logger.info("Migrating JSON hashmap to index")
+        with self._legacy_hashmap_file_path.open("rb") as f:
+            hashmap = json_loads(f.read())
+
+        for hash_key, file_pathname in hashmap.items():
+            self._add_index_entry(*self._hash_key(hash_key), file_pathname)
+        self._legacy_hashmap_file_path.unlink()
+        logger.info("Migrated %s hashmap entries", len(hashmap))
 
-    def _generate_file_pathname_for_uuid(self, uuid_str: str, extension: str):
-        """Generates the full file path of a cache file from an uuid string.
+    def _generate_file_pathname(self, filename: str, extension: str):
+        """Generates the full file path of a cache file from a filename.
         :return: Full file path
         """
-        return f"{self.base_path}/{uuid_str}.{extension}"
+        return f"{self._base_path_str}/{filename}.{extension}"
 
     def _setup(self):
-        """Sets up the hashmap file for the directory given during init.
+        """Sets up the hashmap files for the directory given during init.
         :return: Boolean of hashmap successfully created
         """
         logger.info("Setting up file cache")
-        # check if file already exists
-        if self.hashmap_file_path.exists():
+        # check if files already exist
+        if self.index_file_path.exists() and self.heap_file_path.exists():
             logger.info("Hashmap already exists")
-            return True
+        else:
+            # create directory if needed
+            logger.info("Creating parent directories for hashmap")
+            self.index_file_path.parent.mkdir(parents=True, exist_ok=True)
 
-        # create directory if needed
-        logger.info("Creating parent directories for hashmap")
-        self.hashmap_file_path.parent.mkdir(parents=True, exist_ok=True)
+            # init files with an empty index and heap
+            self._create_index_file(self.index_file_path, self.INDEX_INITIAL_CAPACITY)
+            with self.heap_file_path.open("wb") as f:
+                f.write(self.HEAP_MAGIC)
+            logger.info("Hashmap successfully created")
 
-        # init file with empty json object
-        with self.hashmap_file_path.open("w", encoding="utf-8") as f:
-            f.write(json.dumps({}))
+        self._open_index()
+        self._heap_file = self.heap_file_path.open("ab")
+        self._heap = self._map_file(self.heap_file_path, access=mmap.ACCESS_READ)
 
-        logger.info("Hashmap successfully created")
+        self._migrate_legacy_hashmap()
         return True
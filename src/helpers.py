@@ -1,32 +1,86 @@
+import asyncio
 import math
+import re
+import numpy as np
+
+try:
+    import orjson
+
+    def json_dumps(obj):
+        """Serializes an object to compact JSON bytes."""
+        return orjson.dumps(obj)
+
+    json_loads = orjson.loads
+except ImportError:
+    import json
+
+    def json_dumps(obj):
+        """Serializes an object to compact JSON bytes."""
+        return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+    def json_loads(data):
+        """Parses JSON from a str or bytes-like object."""
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+        return json.loads(data)
+
+# matches any sequence of whitespace characters
+WHITESPACES_RE = re.compile(r"\s+")
+
+
+# compass points of positive and negative coordinates
+COMPASS_POINTS = {
+    'lat': ('N', 'S'),
+    'lon': ('E', 'W')
+}
 
 
 def deg_to_dms(deg, type='lat'):
     """Converts a latitude or longitude coordinate from Decimal Degrees (DD) to Degrees Minutes Seconds (DMS)."""
-    decimals, number = math.modf(deg)
-    d = int(number)
-    m = int(decimals * 60)
-    s = (deg - d - m / 60) * 3600.00
-    compass = {
-        'lat': ('N', 'S'),
-        'lon': ('W', 'E')
-    }
-    compass_str = compass[type][0 if d >= 0 else 1]
-    return '{}º{}\'{:.2f}"{}'.format(abs(d), abs(m), abs(s), compass_str)
-
-
-def nested_key_exists(dictionary, nested_keys):
-    """Checks if a nested key exists in a dictionary."""
-    nested_dict = dictionary
+    # round to the displayed precision first, so the seconds can't be rounded up to 60
+    seconds = round(math.fabs(deg) * 3600, 2)
+    d, seconds = divmod(seconds, 3600)
+    m, s = divmod(seconds, 60)
+    compass_str = COMPASS_POINTS[type][deg < 0.0]
+    return f'{int(d)}º{int(m)}\'{s:.2f}"{compass_str}'
 
-    for key in nested_keys:
-        try:
-            nested_dict = nested_dict[key]
-        except KeyError:
-            return False
+
+def deg_to_dms_array(degs, type='lat'):
+    """Converts an array of latitude or longitude coordinates from Decimal Degrees (DD) to
+    Degrees Minutes Seconds (DMS). Missing coordinates (None or NaN) are returned as None."""
+    degs = np.asarray(degs, dtype=np.float64)
+    seconds = np.round(np.abs(degs) * 3600, 2)
+    d, seconds = np.divmod(seconds, 3600)
+    m, s = np.divmod(seconds, 60)
+    compass_strs = np.where(degs < 0.0, COMPASS_POINTS[type][1], COMPASS_POINTS[type][0])
+    is_missing = np.isnan(degs)
+
+    return [
+        None if missing else f'{int(dd)}º{int(mm)}\'{ss:.2f}"{compass_str}'
+        for (dd, mm, ss, compass_str, missing) in zip(
+            d.tolist(), m.tolist(), s.tolist(), compass_strs.tolist(), is_missing.tolist()
+        )
+    ]
+
+
+def is_event_loop_running():
+    """Checks if an asyncio event loop is already running in the current thread (e.g. in Jupyter), in which case
+    another loop can't be run until complete."""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
     return True
 
 
-def replace_all_whitespaces(string, replace_char=" "):
-    """Replaces all whitespace characters such as tabs, newlines and spaces with a given character."""
-    return replace_char.join(string.split())
+def get_nested_value(dictionary, nested_keys, default=None):
+    """Gets the value of a nested key in a dictionary, walking the dictionary only once.
+    :return: Tuple of the value (or the default if the key doesn't exist) and a boolean of the key existing
+    """
+    nested_dict = dictionary
+
+    for key in nested_keys:
+        if not isinstance(nested_dict, dict) or key not in nested_dict:
+            return default, False
+        nested_dict = nested_dict[key]
+    return nested_dict, True
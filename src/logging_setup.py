@@ -21,19 +21,25 @@ class LogFormatter(logging.Formatter):
 
     RESET_CODE = "\033[0m"
 
+    # (color_on, color_off, color_reverse) of levels without a color
+    NO_COLORS = ("", "", "")
+
     def __init__(self, color, *args, **kwargs):
         super(LogFormatter, self).__init__(*args, **kwargs)
         self.color = color
 
+        # (color_on, color_off, color_reverse) for every colored level
+        self._level_colors = {}
+        if color:
+            self._level_colors = {
+                level: (code, self.RESET_CODE, self.TEXT_STYLES["reverse"])
+                for (level, code) in self.COLOR_CODES.items()
+            }
+
     def format(self, record, *args, **kwargs):
-        if self.color and record.levelno in self.COLOR_CODES:
-            record.color_on = self.COLOR_CODES[record.levelno]
-            record.color_off = self.RESET_CODE
-            record.color_reverse = self.TEXT_STYLES.get("reverse")
-        else:
-            record.color_on = ""
-            record.color_off = ""
-            record.color_reverse = ""
+        record.color_on, record.color_off, record.color_reverse = self._level_colors.get(
+            record.levelno, self.NO_COLORS
+        )
         return super(LogFormatter, self).format(record, *args, **kwargs)
 
 
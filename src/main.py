@@ -1,24 +1,60 @@
 import urllib.parse
+import requests
 import yaml
 import logging
 from datetime import date
 from pathlib import Path
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from src.apis import GoogleMapsApi
 from src.scrapers import RightmoveScraper
 from src.caches import FileCache
 from src.logging_setup import setup_logging
 
-
-def is_valid_config():
+# use the libyaml based loader if available
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
+# keys every element of GOOGLE_MAPS_DIRECTIONS_DATA needs to have (arrival_time is optional)
+_REQUIRED_DIRECTION_KEYS = frozenset({'place_id', 'mode', 'key', 'label'})
+
+# CSV column names of the scraped property data
+_BASE_CSV_HEADERS = {
+    'type': 'Type',
+    'price': 'Price (per month)',
+    'deposit': 'Deposit',
+    'address': 'Address',
+    'bedroom_count': 'Bedrooms',
+    'bathroom_count': 'Bathrooms',
+    'let_available_date': 'Let Available From',
+    'furnish_type': 'Furnish Type',
+    'let_type': 'Let Type',
+    'minimum_term_in_months': 'Minimum Term (in months)',
+    'latitude': 'Latitude',
+    'longitude': 'Longitude',
+    'google_maps_link': 'Google Maps',
+    # 'images': 'Images',
+    'url': 'Link',
+    'floorplan_urls': 'Floorplans',
+    'agent_url': 'Agent',
+}
+
+
+def load_and_validate_config():
+    """Loads the config file and checks that all the required settings are in it.
+    :return: Tuple of a boolean of the config being valid and the loaded config
+    """
     # check if file exists
     config_file = Path('config.yaml')
     if not config_file.is_file():
         logger.critical(f"Configuration file {config_file} not found")
-        return False
+        return False, {}
 
     is_valid = True
     with config_file.open("r") as f:
-        config = yaml.safe_load(f)
+        config = yaml.load(f, Loader=SafeLoader) or {}
 
     # check if rightmove url is set up
     if "RIGHTMOVE_URL" not in config:
@@ -41,23 +77,18 @@ def is_valid_config():
             logger.critical("GOOGLE_MAPS_DIRECTIONS_DATA: has to be a list")
             is_valid = False
         else:
-            # check if all elements have valid keys (arrival_time is optional)
+            # check if all elements have valid keys
             for (i, direction_config) in enumerate(config["GOOGLE_MAPS_DIRECTIONS_DATA"]):
                 number = i + 1
-                if "place_id" not in direction_config:
-                    logger.critical(f"GOOGLE_MAPS_DIRECTIONS_DATA #{number}: place_id needs to be provided")
-                    is_valid = False
-                if "mode" not in direction_config:
-                    logger.critical(f"GOOGLE_MAPS_DIRECTIONS_DATA #{number}: mode needs to be provided")
+                if not isinstance(direction_config, dict):
+                    logger.critical(f"GOOGLE_MAPS_DIRECTIONS_DATA #{number}: has to be a mapping")
                     is_valid = False
-                if "key" not in direction_config:
-                    logger.critical(f"GOOGLE_MAPS_DIRECTIONS_DATA #{number}: key needs to be provided")
-                    is_valid = False
-                if "label" not in direction_config:
-                    logger.critical(f"GOOGLE_MAPS_DIRECTIONS_DATA #{number}: label needs to be provided")
+                    continue
+                for key in sorted(_REQUIRED_DIRECTION_KEYS - direction_config.keys()):
+                    logger.critical(f"GOOGLE_MAPS_DIRECTIONS_DATA #{number}: {key} needs to be provided")
                     is_valid = False
 
-    return is_valid
+    return is_valid, config
 
 
 if __name__ == '__main__':
@@ -82,26 +113,46 @@ if __name__ == '__main__':
     try:
         logger.info("=== SCRIPT STARTED ===")
 
-        if not is_valid_config():
+        is_valid, config = load_and_validate_config()
+        if not is_valid:
             logger.critical("INVALID CONFIG - EXITING")
             exit()
-
-        # load config data
-        with Path('config.yaml').open("r") as f:
-            config = yaml.safe_load(f)
-            logger.info("Config loaded")
+        logger.info("Config loaded")
 
         url = config["RIGHTMOVE_URL"]
         logger.info(f"Calling scraper on url: {url}")
 
+        # set up a session shared by the scraper and the api, with a connection pool for each host
+        # NOTE: with aiohttp installed, the concurrent requests (the result and property pages after the first
+        # page, and the directions) are made with aiohttp sessions of the scraper and the api, so this session
+        # and its retry policy are only used for the rest of the requests and as the fallback without aiohttp
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=8,
+            pool_maxsize=32,
+            # the last response is returned when the retries run out, so its status code can be checked
+            max_retries=Retry(
+                total=3,
+                backoff_factor=0.2,
+                status_forcelist=[429, 500, 502, 503, 504],
+                raise_on_status=False
+            )
+        )
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+
         # set up google maps api object and directions config
         google_maps_api = None
+        file_cache = None
         google_maps_directions_config = ()
         if config.get('GOOGLE_MAPS_API_KEY'):
             logger.info(f"Google Maps API key found")
+            file_cache = FileCache(f"{config['BASE_CACHE_FOLDER_PATH']}/api/google_maps")
             google_maps_api = GoogleMapsApi(
                 api_key=config['GOOGLE_MAPS_API_KEY'],
-                file_cache=FileCache(f"{config['BASE_CACHE_FOLDER_PATH']}/api/google_maps")
+                file_cache=file_cache,
+                max_cache_age=config.get('GOOGLE_MAPS_CACHE_MAX_AGE'),
+                session=session
             )
             google_maps_directions_config = config.get('GOOGLE_MAPS_DIRECTIONS_DATA', ())
         else:
@@ -111,31 +162,21 @@ if __name__ == '__main__':
         rightmove_scraper = RightmoveScraper(
             url=url,
             google_maps_api=google_maps_api,
-            google_maps_directions_config=google_maps_directions_config
+            google_maps_directions_config=google_maps_directions_config,
+            session=session
         )
 
+        # all requests are made while scraping, close the sessions and the cache
+        if google_maps_api:
+            google_maps_api.close()
+            file_cache.close()
+        session.close()
+
         # save CSV file to path
         csv_headers = {
-            'type': 'Type',
-            'price': 'Price (per month)',
-            'deposit': 'Deposit',
-            'address': 'Address',
-            'bedroom_count': 'Bedrooms',
-            'bathroom_count': 'Bathrooms',
-            'let_available_date': 'Let Available From',
-            'furnish_type': 'Furnish Type',
-            'let_type': 'Let Type',
-            'minimum_term_in_months': 'Minimum Term (in months)',
-            'latitude': 'Latitude',
-            'longitude': 'Longitude',
-            'google_maps_link': 'Google Maps',
-            # 'images': 'Images',
-            'url': 'Link',
-            'floorplan_urls': 'Floorplans',
-            'agent_url': 'Agent',
+            **_BASE_CSV_HEADERS,
+            **{direction_data['key']: direction_data['label'] for direction_data in google_maps_directions_config}
         }
-        for direction_data in google_maps_directions_config:
-            csv_headers[direction_data['key']] = direction_data['label']
 
         # create parent directories for CSV file if needed
         csv_path = Path(config['CSV_FILE_PATH'])
@@ -1,16 +1,47 @@
+import asyncio
 import datetime
+import functools
+import re
 import requests
-import json
 import csv
 import logging
-from lxml import html
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from lxml import etree, html
 import numpy as np
 import pandas as pd
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from src.apis import GoogleMapsApi
-from src.helpers import replace_all_whitespaces, nested_key_exists
+from src.helpers import WHITESPACES_RE, get_nested_value, is_event_loop_running, json_loads
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
 
 logger = logging.getLogger(__name__)
 
+# json object assigned to the global "window.PAGE_MODEL" javascript variable in the script tag of a property page
+_PAGE_MODEL_RE = re.compile(rb"window\.PAGE_MODEL\s*=\s*(\{.*?\})\s*;?\s*</script>", re.DOTALL)
+
+# url of a page of search results
+_URL_RE = re.compile(
+    r"^https?://www\.rightmove\.co\.uk/(property-to-rent|property-for-sale|new-homes-for-sale)/find\.html\?"
+)
+
+# lxml parsers can't be used by multiple threads at the same time, so every thread gets its own
+_html_parsers = threading.local()
+
+
+def _get_html_parser():
+    """Returns the html parser of the current thread, which skips everything the scraper doesn't need."""
+    parser = getattr(_html_parsers, 'parser', None)
+    if parser is None:
+        parser = html.HTMLParser(collect_ids=False, remove_blank_text=True, remove_comments=True, huge_tree=False)
+        _html_parsers.parser = parser
+    return parser
+
 
 class RightmoveScraper:
     """The `Rightmove` webscraper collects structured data on properties
@@ -30,11 +61,60 @@ class RightmoveScraper:
     # maximum number of properties shown on a single page
     MAX_RESULT_PER_PAGE = 24
 
+    # headers sent with every request, on top of the ones of the session
+    HEADERS = {
+        'User-Agent': "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) "
+                      "Chrome/100.0.4896.127 Safari/537.36",
+    }
+
+    # (connect, read) timeout of the requests in seconds
+    REQUEST_TIMEOUT = (3.05, 10)
+
+    # retry policy of the requests, for both the requests session and aiohttp
+    RETRY_TOTAL = 3
+    RETRY_BACKOFF_FACTOR = 0.3
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+    # columns of the scraped property data, the directions are inserted before "minimum_term_in_months"
+    COLUMNS = (
+        'type',
+        'price',
+        'deposit',
+        'address',
+        'bedroom_count',
+        'bathroom_count',
+        'let_available_date',
+        'furnish_type',
+        'let_type',
+        'minimum_term_in_months',
+        'latitude',
+        'longitude',
+        'google_maps_link',
+        'images',
+        'url',
+        'floorplan_urls',
+        'agent_url',
+    )
+
+    # columns with only a few distinct values (e.g. flat / detached, furnished / unfurnished, long term / short term)
+    CATEGORICAL_COLUMNS = ('type', 'furnish_type', 'let_type')
+
+    # xpath of the property urls on a page of results
+    _XP_PROPERTY_LINKS = etree.XPath("""//div[@class="propertyCard-details"]//a[@class="propertyCard-link"]/@href""")
+
+    # xpath of the script tag which declares the global "window.PAGE_MODEL" javascript variable
+    _XP_JS_STRING = etree.XPath("""//script[contains(text(), "window.PAGE_MODEL")]/text()""")
+
+    # xpath of the total number of results displayed on a page of results
+    _XP_RESULT_COUNT = etree.XPath("""//span[@class="searchHeader-resultCount"]/text()""")
+
     def __init__(
         self,
         url: str,
         google_maps_api: GoogleMapsApi = None,
-        google_maps_directions_config: tuple = ()
+        google_maps_directions_config: tuple = (),
+        session: requests.Session = None,
+        concurrency: int = 16
     ):
         """Initialize the scraper with a URL from the results of a property
         search performed on www.rightmove.co.uk.
@@ -42,12 +122,47 @@ class RightmoveScraper:
             url (str): full HTML link to a page of Rightmove search results.
             google_maps_api (GoogleMapsApi): Object to handle requests for direction data (eg. travel time / distance)
             google_maps_directions_config (tuple): List of params for Google Maps API to use for getting directions.
+            session (requests.Session): Session used for the first page, and for all the pages when they're not
+                requested with aiohttp, e.g. shared with the Google Maps API. The pages requested with aiohttp
+                only get its headers, its adapters, proxies, cookies and auth are not used for them.
+            concurrency (int): Maximum number of pages requested at the same time, 1 requests them one by one.
+                The pages are requested with aiohttp if it's installed and no event loop is running already,
+                otherwise with a pool of threads.
         """
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=32,
+                pool_maxsize=32,
+                # the last response is returned when the retries run out, so the page is skipped instead of raising
+                max_retries=Retry(
+                    total=self.RETRY_TOTAL,
+                    backoff_factor=self.RETRY_BACKOFF_FACTOR,
+                    status_forcelist=self.RETRY_STATUSES,
+                    raise_on_status=False
+                )
+            )
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+        self._session = session
+        self._concurrency = max(1, concurrency)
+        # only set up while scraping the results, if aiohttp is installed
+        self._loop = None
+        self._aiohttp_session = None
         self._status_code, self._first_page = self._request(url)
         self._url = url
 
         self._google_maps_api = google_maps_api
         self._google_maps_directions_config = google_maps_directions_config
+        # directions already scraped, keyed by `_get_direction_cache_key`
+        self._dir_cache = {}
+
+        # set up the columns of the results, with one for each direction
+        self._direction_keys = []
+        if self._should_get_directions():
+            self._direction_keys = [direction_config['key'] for direction_config in google_maps_directions_config]
+        pos = self.COLUMNS.index('minimum_term_in_months')
+        self._columns = [*self.COLUMNS[:pos], *self._direction_keys, *self.COLUMNS[pos:]]
 
         self._validate_url()
         self._results = self._get_results()
@@ -77,11 +192,80 @@ class RightmoveScraper:
         be accessed to self.MAX_ACCESSIBLE_PAGES."""
         return len(self.get_results)
 
-    @staticmethod
-    def _request(url: str):
-        r = requests.get(url)
+    def _request(self, url: str):
+        try:
+            r = self._session.get(url, headers=self.HEADERS, timeout=self.REQUEST_TIMEOUT)
+        except requests.RequestException as error:
+            # a failed page is skipped like the ones with a status code which isn't OK
+            logger.error("Request failed: %s (%r)", url, error)
+            return None, b""
         return r.status_code, r.content
 
+    def _request_all(self, urls):
+        """Requests all the urls, up to `concurrency` of them at the same time.
+        :return: Iterator of (status_code, content) tuples in the order of the urls
+        """
+        if self._concurrency == 1 or len(urls) <= 1:
+            yield from map(self._request, urls)
+            return
+
+        if self._loop is not None:
+            yield from self._loop.run_until_complete(self._request_all_async(urls))
+            return
+
+        with ThreadPoolExecutor(max_workers=min(self._concurrency, len(urls))) as executor:
+            yield from executor.map(self._request, urls)
+
+    async def _request_all_async(self, urls):
+        session = self._get_aiohttp_session()
+        semaphore = asyncio.Semaphore(self._concurrency)
+        return await asyncio.gather(*[self._request_async(session, semaphore, url) for url in urls])
+
+    async def _request_async(self, session, semaphore, url: str):
+        """Same as `_request` with aiohttp, retried like the requests session.
+        :return: Tuple of the status code (None if the request failed) and the content
+        """
+        async with semaphore:
+            for retry in range(self.RETRY_TOTAL + 1):
+                if retry:
+                    await asyncio.sleep(self.RETRY_BACKOFF_FACTOR * 2 ** (retry - 1))
+                try:
+                    async with session.get(url) as response:
+                        if response.status not in self.RETRY_STATUSES or retry == self.RETRY_TOTAL:
+                            return response.status, await response.read()
+                except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+                    if retry == self.RETRY_TOTAL:
+                        # a failed page is skipped like the ones with a status code which isn't OK
+                        logger.error("Request failed: %s (%r)", url, error)
+                        return None, b""
+
+    def _get_aiohttp_session(self):
+        # has to be created from inside the running event loop, the headers are the same as the requests session
+        # except for Accept-Encoding, aiohttp sets it to the encodings it can decode itself
+        if self._aiohttp_session is None:
+            headers = {
+                key: value for (key, value) in self._session.headers.items() if key.lower() != 'accept-encoding'
+            }
+            self._aiohttp_session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self._concurrency, ttl_dns_cache=300),
+                headers={**headers, **self.HEADERS},
+                timeout=aiohttp.ClientTimeout(sock_connect=self.REQUEST_TIMEOUT[0], sock_read=self.REQUEST_TIMEOUT[1])
+            )
+        return self._aiohttp_session
+
+    def _open_event_loop(self):
+        # inside an already running event loop (e.g. in Jupyter) the pages are requested with threads instead
+        if aiohttp is not None and self._concurrency > 1 and not is_event_loop_running():
+            self._loop = asyncio.new_event_loop()
+
+    def _close_event_loop(self):
+        if self._loop is not None:
+            if self._aiohttp_session is not None:
+                self._loop.run_until_complete(self._aiohttp_session.close())
+                self._aiohttp_session = None
+            self._loop.close()
+            self._loop = None
+
     def refresh_data(self, url: str = None):
         """Make a fresh GET request for the Rightmove data.
         Args:
@@ -91,20 +275,17 @@ class RightmoveScraper:
         url = self.url if not url else url
         self._status_code, self._first_page = self._request(url)
         self._url = url
+        # the counts are cached from the previous first page
+        self.__dict__.pop('results_count_display', None)
+        self.__dict__.pop('page_count', None)
         self._validate_url()
         self._results = self._get_results()
 
     def _validate_url(self):
         """Basic validation that the URL at least starts in the right format and
         returns status code 200."""
-        real_url = "{}://www.rightmove.co.uk/{}/find.html?"
-        protocols = ["http", "https"]
-        types = ["property-to-rent", "property-for-sale", "new-homes-for-sale"]
-        urls = [real_url.format(p, t) for p in protocols for t in types]
-        conditions = [self.url.startswith(u) for u in urls]
-        conditions.append(self._status_code == 200)
-        if not any(conditions):
-            logger.error(f"Invalid rightmove search URL: {self.url}")
+        if not _URL_RE.match(self.url) or self._status_code != 200:
+            logger.error("Invalid rightmove search URL: %s", self.url)
             raise ValueError(f"Invalid rightmove search URL:\n\n\t{self.url}")
 
     # @property
@@ -122,16 +303,15 @@ class RightmoveScraper:
     #     else:
     #         raise ValueError(f"Invalid rightmove URL:\n\n\t{self.url}")
 
-    @property
+    @functools.cached_property
     def results_count_display(self):
         """Returns an integer of the total number of listings as displayed on
         the first page of results. Note that not all listings are available to
         scrape because Rightmove limits the number of accessible pages."""
-        tree = html.fromstring(self._first_page)
-        xpath = """//span[@class="searchHeader-resultCount"]/text()"""
-        return int(tree.xpath(xpath)[0].replace(",", ""))
+        tree = html.fromstring(self._first_page, parser=_get_html_parser())
+        return int(self._XP_RESULT_COUNT(tree)[0].replace(",", ""))
 
-    @property
+    @functools.cached_property
     def page_count(self):
         """Returns the number of result pages returned by the search URL. There
         are 24 results per page. Note that the website limits results to a
@@ -144,115 +324,83 @@ class RightmoveScraper:
             page_count = self.MAX_ACCESSIBLE_PAGES
         return page_count
 
-    def _get_page(self, request_content: str):
+    def _get_page(self, request_content: bytes, seen: set = None):
         """Method to scrape data from a single page of search results. Used
         iteratively by the `get_results` method to scrape data from every page
-        returned by the search."""
+        returned by the search.
+        Args:
+            request_content (bytes): Content of the page of search results.
+            seen (set): Property links scraped from the previous pages, which are skipped on this page. The property
+                links of this page are added to it.
+        """
         # Process the html:
-        tree = html.fromstring(request_content)
-
-        # Set xpath for property URL:
-        xp_property_links = """//div[@class="propertyCard-details"]//a[@class="propertyCard-link"]/@href"""
+        tree = html.fromstring(request_content, parser=_get_html_parser())
 
         # remove empty property_links
-        property_links = list(filter(None, tree.xpath(xp_property_links)))
+        property_links = list(filter(None, self._XP_PROPERTY_LINKS(tree)))
         # set up unique property_links with base url
         property_links = set(map(lambda x: f"{self.BASE_URL}{x}", property_links))
+        # skip the properties which were already on a previous page (e.g. featured properties)
+        if seen is not None:
+            property_links -= seen
+            seen |= property_links
+        property_links = list(property_links)
 
         # TESTING FOR ONLY 1
         # property_links = list(property_links)[0:1]
         # TESTING FOR ONLY 1
 
-        data = {
-            'type': [],
-            'price': [],
-            'deposit': [],
-            'address': [],
-            'bedroom_count': [],
-            'bathroom_count': [],
-            'let_available_date': [],
-            'furnish_type': [],
-            'let_type': [],
-            'minimum_term_in_months': [],
-            'latitude': [],
-            'longitude': [],
-            'google_maps_link': [],
-            'images': [],
-            'url': [],
-            'floorplan_urls': [],
-            'agent_url': [],
-        }
-
-        for property_link in property_links:
-            logger.info(f"Scraping data from property link: {property_link}")
-            status_code, content = self._request(property_link)
-            if status_code != 200:
-                logger.error(f"Response status NOT OK: {property_link}")
-                continue
-            tree = html.fromstring(content)
+        # get the data of all the properties first, so their directions can be requested together
+        properties = []
+        for (property_link, (status_code, content)) in zip(property_links, self._request_all(property_links)):
+            property_data = self._get_property_data(property_link, status_code, content)
+            if property_data:
+                properties.append((property_link, property_data))
 
-            # get global "window.PAGE_MODEL" javascript variable from a script tag, since it has all the info we need
-            xp_js_string = """//script[contains(text(), "window.PAGE_MODEL")]/text()"""
-            js_string = tree.xpath(xp_js_string)
-            try:
-                # split string after variable declaration to get the json object
-                json_string = js_string[0].split("window.PAGE_MODEL =")[1]
-                # make raw string out of it to ignore the potential escape characters
-                json_string = r"{}".format(json_string)
-                json_data = json.loads(json_string)
-            except (ValueError, KeyError) as error:
-                # if it can't properly parse the json variable then skip to the next link
-                logger.error(f"Invalid JSON data from string: {js_string}")
-                logger.error(error)
-                continue
-
-            # all property related info should be inside propertyData (duh)
-            property_data = json_data.get('propertyData')
-            if not property_data:
-                logger.error(f"No property data found in JSON data")
-                continue
+        self._prefetch_directions_data([
+            property_data.get('location', {}) for (_, property_data) in properties
+        ])
 
+        rows = []
+        addresses = []
+        for (property_link, property_data) in properties:
             # add link
-            data['url'].append(property_link)
+            row = {'url': property_link}
 
             # get property type (semi-detached, detached etc.)
             if "propertySubType" not in property_data:
                 logger.warning("Property type not found in property data")
-            data['type'].append(property_data.get('propertySubType', np.nan))
+            row['type'] = property_data.get('propertySubType', np.nan)
 
             # get monthly price
-            if not nested_key_exists(property_data, ['prices', 'primaryPrice']):
+            (row['price'], found) = get_nested_value(property_data, ['prices', 'primaryPrice'], np.nan)
+            if not found:
                 logger.warning("Price not found in property data")
-            data['price'].append(property_data.get('prices', {}).get('primaryPrice', np.nan))
 
             # get agent urls
-            if not nested_key_exists(property_data, ['customer', 'customerProfileUrl']):
+            (row['agent_url'], found) = get_nested_value(property_data, ['customer', 'customerProfileUrl'], np.nan)
+            if not found:
                 logger.warning("Agent url not found in property data")
-            data['agent_url'].append(property_data.get('customer', {}).get('customerProfileUrl', np.nan))
 
             # get floorplan urls
             if "floorplans" not in property_data:
                 logger.warning("Floorplan url not found in property data")
-            data['floorplan_urls'].append(
-                [fp.get('url', '') for fp in property_data.get('floorplans', [])]
-            )
+            row['floorplan_urls'] = [fp.get('url') or '' for fp in property_data.get('floorplans', [])]
 
             # get images
             if "images" not in property_data:
                 logger.warning("Images not found in property data")
-            data['images'].append(
-                [fp.get('url', '') for fp in property_data.get('images', [])]
-            )
+            row['images'] = [fp.get('url') or '' for fp in property_data.get('images', [])]
 
             # get number of bedrooms
             if "bedrooms" not in property_data:
                 logger.warning("Number of bedrooms not found in property data")
-            data['bedroom_count'].append(property_data.get('bedrooms', np.nan))
+            row['bedroom_count'] = property_data.get('bedrooms', np.nan)
 
             # get number of bathrooms
             if "bathrooms" not in property_data:
                 logger.warning("Number of bathrooms not found in property data")
-            data['bathroom_count'].append(property_data.get('bathrooms', np.nan))
+            row['bathroom_count'] = property_data.get('bathrooms', np.nan)
 
             # get data related to lettings
             lettings = property_data.get('lettings', {})
@@ -260,29 +408,29 @@ class RightmoveScraper:
             # get let available date
             if "letAvailableDate" not in lettings:
                 logger.warning("Let available date not found in property data")
-            data['let_available_date'].append(lettings.get('letAvailableDate', 'Now') or 'Now')
+            row['let_available_date'] = lettings.get('letAvailableDate', 'Now') or 'Now'
 
             # get deposit
             if "deposit" not in lettings:
                 logger.warning("Deposit not found in property data")
             deposit = lettings.get('deposit', np.nan)
             deposit = "£{:,.0f}".format(deposit or 0)
-            data['deposit'].append(deposit)
+            row['deposit'] = deposit
 
             # get furnish type (furnished / unfurnished)
             if "furnishType" not in lettings:
                 logger.warning("Furnish type not found in property data")
-            data['furnish_type'].append(lettings.get('furnishType', np.nan))
+            row['furnish_type'] = lettings.get('furnishType', np.nan)
 
             # get let type (long term / short term)
             if "letType" not in lettings:
                 logger.warning("Let type not found in property data")
-            data['let_type'].append(lettings.get('letType', np.nan))
+            row['let_type'] = lettings.get('letType', np.nan)
 
             # get minimum term in months
             if "minimumTermInMonths" not in lettings:
                 logger.warning("Minimum term in months not found in property data")
-            data['minimum_term_in_months'].append(lettings.get('minimumTermInMonths', 0) or 0)
+            row['minimum_term_in_months'] = lettings.get('minimumTermInMonths', 0) or 0
 
             # get location
             location_data = property_data.get('location', {})
@@ -297,111 +445,246 @@ class RightmoveScraper:
             for key, direction_data in directions_data.items():
                 duration = direction_data.get('duration') or 'Unknown'
                 distance = direction_data.get('distance') or 'Unknown'
-                if key not in data or not isinstance(data[key], list):
-                    # insert new list for each direction before key "minimum_term_in_months"
-                    pos = list(data.keys()).index('minimum_term_in_months')
-                    items = list(data.items())
-                    items.insert(pos, (key, []))
-                    data = dict(items)
-                data[key].append(f"{duration} ({distance})")
-            data['latitude'].append(latitude)
-            data['longitude'].append(longitude)
-            # add google maps link
-            if latitude is not None and longitude is not None:
-                data['google_maps_link'].append(GoogleMapsApi.get_google_maps_url(latitude, longitude))
-            else:
-                data['google_maps_link'].append(np.nan)
-
-            # get address
-            try:
-                address_data = property_data.get("address", {})
-                if "outcode" not in address_data:
-                    logger.warning("Postcode outward code not found in property data")
-                if "incode" not in address_data:
-                    logger.warning("Postcode inward code not found in property data")
-                if "displayAddress" not in address_data:
-                    logger.warning("Address not found in property data")
-                out_code = address_data.get('outcode')
-                in_code = address_data.get('incode')
-                display_address = address_data.get('displayAddress', '')
-                display_address = display_address.replace(out_code, '').replace(in_code, '')  # remove post code
-                display_address = replace_all_whitespaces(display_address)  # remove extra whitespaces
-                display_address = display_address.rstrip(',')  # remove pointless comma from end of string
-
-                full_address = []
-                if out_code or in_code:
-                    full_address.append(f"{out_code}{in_code}")
-                if display_address:
-                    full_address.append(display_address)
-                data['address'].append(', '.join(full_address))
-            except KeyError:
-                data['address'].append(np.nan)
+                row[key] = f"{duration} ({distance})"
+            row['latitude'] = latitude
+            row['longitude'] = longitude
+
+            # get address, it's put together for all the properties at once
+            address_data = property_data.get("address", {})
+            if "outcode" not in address_data:
+                logger.warning("Postcode outward code not found in property data")
+            if "incode" not in address_data:
+                logger.warning("Postcode inward code not found in property data")
+            if "displayAddress" not in address_data:
+                logger.warning("Address not found in property data")
+            addresses.append(
+                (address_data.get('outcode'), address_data.get('incode'), address_data.get('displayAddress'))
+            )
 
+            rows.append(row)
             logger.info("Scrape successful")
 
-        logger.debug(f"Rightmove scraped data: {data}")
+        # the rows are only formatted if they're logged
+        logger.debug("Rightmove scraped data: %s", rows)
         # return the data in a Pandas DataFrame
-        return pd.DataFrame(data)
+        results = pd.DataFrame(rows, columns=self._columns)
+
+        # add full addresses and google maps links for all the properties at once
+        results['address'] = self._get_full_addresses(addresses)
+        results['google_maps_link'] = GoogleMapsApi.get_google_maps_urls(results['latitude'], results['longitude'])
+
+        return results
+
+    @staticmethod
+    def _get_full_addresses(addresses):
+        """Puts together the addresses in the "<postcode>, <display address>" format.
+        Args:
+            addresses (list): Tuples of (outward code, inward code, display address), any of them can be None
+        :return: Array of the addresses, NaN when none of the parts are found
+        """
+        if not addresses:
+            return np.array([], dtype=object)
+
+        addresses = pd.DataFrame(addresses, columns=['out_code', 'in_code', 'display_address'], dtype=object)
+        addresses = addresses.fillna('').astype(str)
+        postcodes = addresses['out_code'] + addresses['in_code']
+
+        # remove post code from the display address
+        display_addresses = np.char.replace(
+            addresses['display_address'].to_numpy(dtype=str), addresses['out_code'].to_numpy(dtype=str), ''
+        )
+        display_addresses = np.char.replace(display_addresses, addresses['in_code'].to_numpy(dtype=str), '')
+        display_addresses = (
+            pd.Series(display_addresses, index=addresses.index, dtype=object)
+            .str.replace(WHITESPACES_RE, " ", regex=True)  # remove extra whitespaces
+            .str.strip()
+            .str.rstrip(',')  # remove pointless comma from end of string
+        )
+
+        full_addresses = np.where(
+            (postcodes != '') & (display_addresses != ''),
+            postcodes + ', ' + display_addresses,
+            postcodes + display_addresses
+        )
+        return np.where(full_addresses == '', np.nan, full_addresses)
+
+    @classmethod
+    def _get_property_data(cls, property_link: str, status_code: int, content: bytes):
+        """Scrapes the property data from the response of the page of a single property.
+        :return: Dictionary of the property data or None if it can't be found
+        """
+        logger.info("Scraping data from property link: %s", property_link)
+        if status_code != 200:
+            logger.error("Response status NOT OK: %s", property_link)
+            return None
+        # get global "window.PAGE_MODEL" javascript variable from a script tag, since it has all the info we need
+        json_string = js_string = None
+        try:
+            # search the raw content first, so the html doesn't have to be parsed
+            match = _PAGE_MODEL_RE.search(content)
+            if match:
+                json_string = match.group(1)
+            else:
+                tree = html.fromstring(content, parser=_get_html_parser())
+                js_string = cls._XP_JS_STRING(tree)
+                # split string after variable declaration to get the json object
+                json_string = js_string[0].split("window.PAGE_MODEL =")[1]
+            json_data = json_loads(json_string)
+        except (ValueError, KeyError, IndexError) as error:
+            # if it can't properly parse the json variable then skip to the next link
+            logger.error("Invalid JSON data from string: %s", json_string or js_string)
+            logger.error(error)
+            return None
+
+        # all property related info should be inside propertyData (duh)
+        property_data = json_data.get('propertyData')
+        if not property_data:
+            logger.error("No property data found in JSON data")
+            return None
+
+        return property_data
+
+    def _should_get_directions(self):
+        return isinstance(self.google_maps_api, GoogleMapsApi) and bool(self.google_maps_directions_config)
+
+    def _prefetch_directions_data(self, locations):
+        """Gets the directions from all the locations into the directions cache with distance matrix calls,
+        one batch of calls for every mode and arrival time combination of the directions config.
+        """
+        if not self._should_get_directions():
+            return
+
+        coordinates = [
+            (location['latitude'], location['longitude'])
+            for location in locations
+            if location.get('latitude') is not None and location.get('longitude') is not None
+        ]
+        if not coordinates:
+            return
+
+        # group destinations which can be requested in the same call
+        place_ids_by_params = {}
+        for direction_config in self.google_maps_directions_config:
+            params = (direction_config['mode'], direction_config.get('arrival_time'))
+            place_ids_by_params.setdefault(params, []).append(direction_config['place_id'])
+
+        for ((mode, arrival_time), place_ids) in place_ids_by_params.items():
+            # only request each origin once, and not at all when all its directions are already cached, origins
+            # sharing their cache keys (e.g. in the same building) count as the same one
+            origins = {}
+            requested_coordinates = set()
+            for (latitude, longitude) in coordinates:
+                cache_keys = [
+                    self._get_direction_cache_key(latitude, longitude, place_id, mode, arrival_time)
+                    for place_id in place_ids
+                ]
+                rounded_coordinates = cache_keys[0][:2]
+                if rounded_coordinates in requested_coordinates or all(key in self._dir_cache for key in cache_keys):
+                    continue
+                requested_coordinates.add(rounded_coordinates)
+                origins[f"{latitude},{longitude}"] = (latitude, longitude)
+            if not origins:
+                continue
+
+            directions = self.google_maps_api.get_distance_matrix(
+                origins=list(origins),
+                place_ids=place_ids,
+                mode=mode,
+                arrival_time=arrival_time
+            )
+            for ((origin, place_id), direction) in directions.items():
+                cache_key = self._get_direction_cache_key(*origins[origin], place_id, mode, arrival_time)
+                self._dir_cache[cache_key] = {
+                    'distance': direction.get('distance'),
+                    'duration': direction.get('duration')
+                }
 
     def _get_directions_data(self, latitude, longitude):
         directions_data = {}
 
         # check if directions api should run
-        if (
-            not isinstance(self.google_maps_api, GoogleMapsApi)
-            or not self.google_maps_directions_config
-            or latitude is None
-            or longitude is None
-        ):
+        if not self._should_get_directions() or latitude is None or longitude is None:
             return directions_data
 
-        # run the directions api with the params from the directions config
+        # use the cached directions, and only call the directions api for the ones not found
+        cache_keys = {}
+        missing_directions_config = []
         for direction_config in self.google_maps_directions_config:
-            direction = self.google_maps_api.get_directions(
+            cache_keys[direction_config['key']] = self._get_direction_cache_key(
+                latitude,
+                longitude,
+                direction_config['place_id'],
+                direction_config['mode'],
+                direction_config.get('arrival_time')
+            )
+            if cache_keys[direction_config['key']] not in self._dir_cache:
+                missing_directions_config.append(direction_config)
+
+        # run the directions api with the params from the directions config
+        if missing_directions_config:
+            missing_directions = self.google_maps_api.get_all_directions(
                 origin=f"{latitude},{longitude}",
-                place_id=direction_config['place_id'],
-                mode=direction_config['mode'],
-                arrival_time=direction_config['arrival_time']
+                directions_config=missing_directions_config
             )
+            for (direction_config, direction) in zip(missing_directions_config, missing_directions):
+                self._dir_cache[cache_keys[direction_config['key']]] = {
+                    'distance': direction.get('distance'),
+                    'duration': direction.get('duration')
+                }
 
-            directions_data[direction_config['key']] = {
-                'distance': direction.get('distance'),
-                'duration': direction.get('duration')
-            }
+        for direction_config in self.google_maps_directions_config:
+            directions_data[direction_config['key']] = self._dir_cache[cache_keys[direction_config['key']]]
 
         return directions_data
 
+    @staticmethod
+    def _get_direction_cache_key(latitude, longitude, place_id, mode, arrival_time):
+        """Properties closer than ~1 meter to each other (e.g. in the same building) share their directions."""
+        return round(latitude, 5), round(longitude, 5), place_id, mode, arrival_time
+
     def _get_results(self):
         """Build a Pandas DataFrame with all results returned by the search."""
-        # get the first page to scrape all the links there
-        results = self._get_page(str(self._first_page))
+        # a single aiohttp session is used for all the pages
+        self._open_event_loop()
+        try:
+            frames = self._get_pages()
+        finally:
+            self._close_event_loop()
+
+        # concatenate the DataFrames of all the pages at once:
+        results = pd.concat(frames, ignore_index=True)
 
-        # iterate through all the rest of the pages
-        for p in range(1, self.page_count, 1):
+        return self._clean_results(results)
 
-            # create the URL of the specific results page
-            next_page = f"{str(self.url)}&index={p * self.MAX_RESULT_PER_PAGE}"
+    def _get_pages(self):
+        """Scrapes every page of results.
+        :return: List of DataFrames, one for each page
+        """
+        # get the first page to scrape all the links there
+        seen = set()
+        frames = [self._get_page(self._first_page, seen)]
 
-            # make the request
-            status_code, content = self._request(next_page)
+        # create the URLs of all the rest of the results pages
+        next_pages = [f"{str(self.url)}&index={p * self.MAX_RESULT_PER_PAGE}" for p in range(1, self.page_count, 1)]
+
+        # iterate through all the rest of the pages, while the later ones are already being requested
+        for (next_page, (status_code, content)) in zip(next_pages, self._request_all(next_pages)):
 
             # requests to scrape lots of pages eventually dies
             if status_code != 200:
-                logger.error(f"Error when trying to scrape url: {next_page}")
+                logger.error("Error when trying to scrape url: %s", next_page)
                 break
 
-            # create a temporary DataFrame of page results:
-            temp_df = self._get_page(str(content))
-
-            # concatenate the temporary DataFrame with the full DataFrame:
-            results = pd.concat([results, temp_df])
+            # create a DataFrame of page results:
+            frames.append(self._get_page(content, seen))
 
-        return self._clean_results(results)
+        return frames
 
-    @staticmethod
-    def _clean_results(results: pd.DataFrame):
-        # reset the index:
-        results.reset_index(inplace=True, drop=True)
+    @classmethod
+    def _clean_results(cls, results: pd.DataFrame):
+        # store the columns with only a few distinct values as categories:
+        for column in cls.CATEGORICAL_COLUMNS:
+            results[column] = results[column].astype('category')
 
         # add column with datetime when the search was run (i.e. now):
         now = datetime.datetime.now()
@@ -415,9 +698,9 @@ class RightmoveScraper:
 
         # format dataframe arrays for csv
         if 'images' in headers:
-            results['images'] = ['\n'.join(map(str, img)) for img in results['images']]
+            results['images'] = results['images'].str.join('\n')
         if 'floorplan_urls' in headers:
-            results['floorplan_urls'] = ['\n'.join(map(str, floorplan)) for floorplan in results['floorplan_urls']]
+            results['floorplan_urls'] = results['floorplan_urls'].str.join('\n')
 
         # format columns for csv
         results = results.rename(columns=headers)
@@ -432,5 +715,6 @@ class RightmoveScraper:
             header=True,
             index=False,
             quoting=csv.QUOTE_ALL,
+            lineterminator='\n',
             columns=filtered_keys
         )
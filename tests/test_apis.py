@@ -0,0 +1,48 @@
+import os
+from src.apis import GoogleMapsApi
+from src.caches import FileCache
+from src.helpers import json_dumps
+
+DIRECTIONS_CONTENT = json_dumps({
+    "status": "OK",
+    "routes": [{"legs": [{"distance": {"text": "1.2 km"}, "duration": {"text": "15 mins"}}]}],
+})
+
+
+class FakeResponse:
+    def __init__(self, status_code, content=b"", headers=None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+
+
+class FakeSession:
+    """Answers like the directions API, with a 304 when the request has a matching ETag."""
+
+    def __init__(self):
+        self.sent_headers = []
+
+    def get(self, url, headers=None, timeout=None):
+        self.sent_headers.append(headers)
+        if headers and headers.get('If-None-Match') == '"v1"':
+            return FakeResponse(304)
+        return FakeResponse(200, DIRECTIONS_CONTENT, {'ETag': '"v1"'})
+
+
+def test_directions_are_requested_again_when_cache_file_is_missing(tmp_path):
+    session = FakeSession()
+    with FileCache(tmp_path) as file_cache:
+        api = GoogleMapsApi("key", file_cache=file_cache, max_cache_age=60, session=session)
+        url = api._build_directions_url("51.5,-0.12", "place", None, None)
+        direction = {'distance': "1.2 km", 'duration': "15 mins"}
+        assert api.get_directions("51.5,-0.12", "place") == direction
+
+        # the expired cache file is revalidated with its etag
+        os.utime(file_cache._get_file_path_from_hashmap(url), (0, 0))
+        assert api.get_directions("51.5,-0.12", "place") == direction
+        assert session.sent_headers[-1] == {'If-None-Match': '"v1"'}
+
+        # without the cache file the etag isn't sent, so the content is downloaded again
+        file_cache._get_file_path_from_hashmap(url).unlink()
+        assert api.get_directions("51.5,-0.12", "place") == direction
+        assert session.sent_headers[-1] is None
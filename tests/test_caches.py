@@ -0,0 +1,117 @@
+import pytest
+from src.caches import FileCache
+from src.helpers import json_dumps, json_loads
+
+
+@pytest.fixture
+def small_index(monkeypatch):
+    # a small index is resized after a few entries
+    monkeypatch.setattr(FileCache, "INDEX_INITIAL_CAPACITY", 8)
+
+
+def test_create_and_get_cache_file(tmp_path):
+    with FileCache(tmp_path / "cache") as file_cache:
+        file_cache.create_cache_file("https://example.com/a", {"a": 1}, "json", etag='"abc"')
+        file_cache.create_cache_file("https://example.com/b", "b", "txt")
+
+        assert file_cache.get_cached_file_content("https://example.com/a", loads=json_loads) == {"a": 1}
+        assert file_cache.get_cached_file_content("https://example.com/b") == b"b"
+        assert file_cache.get_cached_file_etag("https://example.com/a") == '"abc"'
+        assert file_cache.get_cached_file_etag("https://example.com/b") is None
+        assert file_cache.get_cached_file_content("https://example.com/c") is None
+        assert file_cache.get_cached_file_etag("https://example.com/c") is None
+
+
+def test_get_large_cache_file_from_memory_map(tmp_path):
+    content = {"items": ["x" * 100] * 100}
+    assert len(json_dumps(content)) >= FileCache.MMAP_MIN_FILE_SIZE
+
+    with FileCache(tmp_path) as file_cache:
+        file_cache.create_cache_file("key", content, "json")
+        assert file_cache.get_cached_file_content("key", loads=json_loads) == content
+
+
+def test_expired_cache_file(tmp_path):
+    with FileCache(tmp_path) as file_cache:
+        file_cache.create_cache_file("key", b"content", "txt")
+        assert file_cache.get_cached_file_content("key", max_age=-1) is None
+        assert file_cache.get_cached_file_content("key", max_age=60) == b"content"
+
+
+def test_overwrite_cache_file(tmp_path):
+    with FileCache(tmp_path) as file_cache:
+        file_cache.create_cache_file("key", b"old", "txt", etag='"old"')
+        file_cache.create_cache_file("key", b"new", "txt")
+
+        assert file_cache.get_cached_file_content("key") == b"new"
+        assert file_cache.get_cached_file_etag("key") is None
+        assert file_cache._get_index_count() == 1
+
+
+def test_resize_index(tmp_path, small_index):
+    keys = [f"key-{i}" for i in range(50)]
+    with FileCache(tmp_path) as file_cache:
+        for key in keys:
+            file_cache.create_cache_file(key, key, "txt")
+
+        assert file_cache._index_capacity > 8
+        assert file_cache._get_index_count() == len(keys)
+        assert file_cache._get_index_count() <= file_cache._index_capacity * FileCache.INDEX_MAX_LOAD_FACTOR
+        for key in keys:
+            assert file_cache.get_cached_file_content(key) == key.encode()
+
+    # the resized index is used when the cache is opened again
+    with FileCache(tmp_path) as file_cache:
+        assert all(file_cache.get_cached_file_content(key) == key.encode() for key in keys)
+
+
+def test_second_instance_sees_writes_and_resizes(tmp_path, small_index):
+    with FileCache(tmp_path) as first, FileCache(tmp_path) as second:
+        first.create_cache_file("first", b"1", "txt")
+        assert second.get_cached_file_content("first") == b"1"
+
+        # the first instance resizes the index, which the second one still has mapped
+        keys = [f"key-{i}" for i in range(50)]
+        for key in keys:
+            first.create_cache_file(key, key, "txt")
+        assert all(second.get_cached_file_content(key) == key.encode() for key in keys)
+
+        # the second instance writes to the resized index
+        second.create_cache_file("second", b"2", "txt", etag='"2"')
+        assert first.get_cached_file_content("second") == b"2"
+        assert first.get_cached_file_etag("second") == '"2"'
+        assert first._get_index_count() == len(keys) + 2
+
+
+def test_migrate_legacy_hashmap(tmp_path):
+    (tmp_path / "a.json").write_bytes(b'{"a": 1}')
+    (tmp_path / "b.json").write_bytes(b'{"b": 2}')
+    (tmp_path / "_hashmap.json").write_bytes(json_dumps({
+        "key-a": f"{tmp_path}/a.json",
+        "key-b": f"{tmp_path}/b.json",
+    }))
+
+    with FileCache(tmp_path) as file_cache:
+        assert file_cache.get_cached_file_content("key-a", loads=json_loads) == {"a": 1}
+        assert file_cache.get_cached_file_content("key-b", loads=json_loads) == {"b": 2}
+        assert file_cache.get_cached_file_content("key-c") is None
+
+    assert not (tmp_path / "_hashmap.json").exists()
+
+
+def test_close(tmp_path):
+    file_cache = FileCache(tmp_path)
+    file_cache.close()
+    assert file_cache._index is None and file_cache._heap is None and file_cache._heap_file is None
+    # closing again does nothing
+    file_cache.close()
+
+
+def test_etag_of_missing_cache_file(tmp_path):
+    with FileCache(tmp_path) as file_cache:
+        file_cache.create_cache_file("key", b"content", "txt", etag='"abc"')
+        file_cache._get_file_path_from_hashmap("key").unlink()
+
+        # the content can't be revalidated without the file
+        assert file_cache.get_cached_file_etag("key") is None
+        assert file_cache.get_cached_file_content("key") is None
@@ -0,0 +1,13 @@
+import math
+import pytest
+from src.helpers import deg_to_dms, deg_to_dms_array
+
+
+@pytest.mark.parametrize("type", ["lat", "lon"])
+def test_deg_to_dms_array_matches_deg_to_dms(type):
+    degs = [51.5007, -0.1246, 0.0, -0.0, 59.99999, -179.999999]
+    assert deg_to_dms_array(degs, type) == [deg_to_dms(deg, type) for deg in degs]
+
+
+def test_deg_to_dms_array_missing_coordinates():
+    assert deg_to_dms_array([None, math.nan, 1.0], "lat") == [None, None, deg_to_dms(1.0, "lat")]